@@ -3,30 +3,129 @@
 Scrape comments from specific r/ausjdocs posts about hospital pharmacy collaboration
 """
 
-import requests  # For sending HTTP requests to Reddit
-import json  # For working with JSON data
-import time  # For adding time delays (to be polite to Reddit)
+from concurrent.futures import ThreadPoolExecutor, as_completed  # For fetching posts in parallel
+from dataclasses import dataclass, field  # For the column-wise comment table
+import diskcache  # For caching scraped posts on disk between runs
+import httpx  # For sending HTTP requests to Reddit (pooled, HTTP/2)
+import logging  # For buffered, level-filtered progress messages
+import orjson  # For fast JSON parsing and serialisation
+import threading  # For serialising /api/morechildren calls across worker threads
+from rate_limiter import RedditRateLimiter, backoff_delay  # Paces requests using Reddit's rate-limit headers
+
+# Set up logging for progress and error messages
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+# Headers with a User-Agent string (to simulate a browser request), set once as the client default
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# Authors whose comments are skipped (deleted/removed comments and moderation bots)
+_SKIP_AUTHORS = frozenset(('[deleted]', 'AutoModerator', '[removed]'))
+
+# Ask Reddit to inline nested replies and return unescaped text in one response
+COMMENT_PARAMS = {'limit': 500, 'depth': 10, 'raw_json': 1, 'sort': 'top'}
+
+# Maximum number of comment ids accepted by a single /api/morechildren request
+MORE_CHILDREN_BATCH = 100
+
+# On-disk cache of scraped posts: location, freshness (seconds) and maximum size (bytes)
+CACHE_DIR = '.reddit_cache'
+CACHE_TTL = 3600
+CACHE_SIZE_LIMIT = 200_000_000
+
+# Worker threads fetching posts at once (the shared rate limiter still paces their requests)
+MAX_WORKERS = 4
+
+@dataclass
+class CommentTable:
+    """Comments of one post stored column-wise, one list per field
+
+    Row i of every list describes the same comment; parent_idx holds the row of the
+    comment it replies to, or -1 for top-level comments.
+    """
+    authors: list = field(default_factory=list)
+    bodies: list = field(default_factory=list)
+    scores: list = field(default_factory=list)
+    created_utc: list = field(default_factory=list)
+    depth: list = field(default_factory=list)
+    is_submitter: list = field(default_factory=list)
+    parent_idx: list = field(default_factory=list)
+    
+    def __len__(self):
+        return len(self.authors)
+    
+    def add(self, author, body, score, created_utc, depth, is_submitter, parent_idx):
+        """Append one comment and return its row index"""
+        self.authors.append(author)
+        self.bodies.append(body)
+        self.scores.append(score)
+        self.created_utc.append(created_utc)
+        self.depth.append(depth)
+        self.is_submitter.append(is_submitter)
+        self.parent_idx.append(parent_idx)
+        return len(self.authors) - 1
 
 class CommentScraper:
-    def __init__(self):
-        # Initialize headers for the requests with a User-Agent string (to simulate a browser request)
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+    def __init__(self, cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL):
         self.base_url = 'https://old.reddit.com'  # Reddit's old site URL (more stable for scraping)
+        # One pooled HTTP/2 client so every request reuses the same warm connection (thread-safe)
+        self.client = httpx.Client(
+            http2=True,
+            headers=HEADERS,  # Sent with every request without per-call merging
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+        )
+        self.limiter = RedditRateLimiter()  # Replaces fixed politeness delays; shared by all threads
+        # Reddit rejects overlapping /api/morechildren calls from one client, so threads take turns
+        self._more_children_lock = threading.Lock()
+        # Scraped posts keyed by post ID; entries expire after cache_ttl and old ones are
+        # evicted once the cache grows past its size limit
+        self.cache = diskcache.Cache(cache_dir, size_limit=CACHE_SIZE_LIMIT)
+        self.cache_ttl = cache_ttl
+    
+    def close(self):
+        """Close the underlying HTTP client and its pooled connections, and the cache"""
+        self.client.close()
+        self.cache.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def _get(self, url, params=None, retries=3):
+        """GET a URL within Reddit's rate budget, retrying after 429 responses"""
+        for attempt in range(retries):
+            self.limiter.acquire()  # Wait for the next free slot in the rate budget
+            response = self.client.get(url, params=params)
+            self.limiter.update(response.headers)
+            if response.status_code != 429:
+                break
+            delay = self.limiter.backoff(response.headers.get('Retry-After'), backoff_delay(attempt))
+            if attempt < retries - 1:
+                logging.warning(f"  ⏳ Rate limited, backing off {delay:.1f}s")
+        response.raise_for_status()  # Check if the request was successful (status code 200)
+        return response
     
     def get_post_comments(self, post_id):
         """Fetch all comments from a specific post"""
         url = f"{self.base_url}/r/ausjdocs/comments/{post_id}.json"  # URL for the comments of a specific post
         
+        cached = self.cache.get(post_id)  # Reuse a recent scrape of this post if there is one
+        if cached is not None:
+            logging.info(f"Using cached comments for post {post_id}")
+            return cached
+        
         try:
-            print(f"Fetching comments for post {post_id}...")
-            response = requests.get(url, headers=self.headers)  # Make a GET request to fetch data
-            response.raise_for_status()  # Check if the request was successful (status code 200)
-            data = response.json()  # Parse the response data as JSON
+            logging.info(f"Fetching comments for post {post_id}...")
+            # Make a GET request on the pooled connection and parse it as JSON; the raw body is
+            # not kept around once parsed
+            data = orjson.loads(self._get(url, params=COMMENT_PARAMS).content)
             
             if len(data) < 2:  # If there's no comment data
-                print("  ⚠️ No comments found")
+                logging.warning(f"  ⚠️ No comments found for post {post_id}")
                 return []  # Return empty list if no comments are found
             
             # Extract the post's information (title, text, score, and number of comments)
@@ -38,56 +137,173 @@ class CommentScraper:
                 'num_comments': post_data['num_comments']
             }
             
-            # Extract the comments from the data
-            comments = self._extract_comments(data[1]['data']['children'])
-            
-            print(f"  ✅ Found {len(comments)} comments")  # Print how many comments were found
+            # Extract the comments from the data, noting replies Reddit left behind stubs
+            comments = CommentTable()
+            more = []  # Comment ids behind 'more' stubs
+            deep = []  # Fullnames of comments whose replies were cut off at the depth limit
+            index = {}
+            if post_info['num_comments'] > 0:  # Posts without comments have nothing to extract
+                self._extract_comments(data[1]['data']['children'], comments, more=more, deep=deep, index=index)
+            # Only the extracted fields are needed from here on, so drop the full parsed tree
+            # (body_html, awards, etc.) before any further network round trips
+            del data, post_data
+            complete = self._fetch_remaining(post_id, comments, more, deep, index)
             
-            time.sleep(2)  # Be polite and wait for 2 seconds before making the next request
+            logging.info(f"  ✅ Found {len(comments)} comments for post {post_id}")  # Log how many comments were found
             
-            return {
+            result = {
                 'post_id': post_id,  # Include the post ID in the returned data
                 'post_info': post_info,  # Include post information
-                'comments': comments  # Include the list of comments
+                'comments': comments  # Include the comment table (serialised column-wise)
             }
+            if complete:
+                self.cache.set(post_id, result, expire=self.cache_ttl)
+            else:  # Don't serve a partial scrape as if it were complete on the next run
+                logging.warning(f"  ⚠️ Some replies for post {post_id} could not be fetched; not caching")
+            return result
             
         except Exception as e:
-            print(f"  ❌ Error: {e}")  # Print any errors that occur
+            logging.error(f"  ❌ Error fetching post {post_id}: {e}")  # Log any errors that occur
             return None  # Return None if there's an error
 
-    def _extract_comments(self, comment_data, depth=0):
-        """Recursively extract comments and replies"""
-        comments = []  # Initialize an empty list to store extracted comments
+    def _fetch_remaining(self, post_id, comments, more, deep, index):
+        """Fetch replies behind 'more' and 'continue this thread' stubs until none are left
+
+        Fetched replies can contain further stubs, which are appended to `more` and `deep`
+        and picked up by the next round. Returns False if any of the fetches failed.
+        """
+        complete = True
+        requested = set()  # Stubs already fetched, so a repeated stub cannot loop forever
+        while more or deep:
+            if more:
+                children = [c for c in dict.fromkeys(more) if c not in requested]
+                more.clear()
+                requested.update(children)
+                if children:
+                    complete &= self._fetch_more_children(post_id, children, comments, index, more, deep)
+            else:
+                parent_name = deep.pop()
+                if parent_name not in requested:
+                    requested.add(parent_name)
+                    complete &= self._fetch_continued_thread(post_id, parent_name, comments, index, more, deep)
+        return complete
+
+    def _fetch_more_children(self, post_id, children, comments, index, more, deep):
+        """Fetch replies hidden behind 'more' stubs and attach them to their parents
+
+        Returns False if any batch could not be fetched.
+        """
+        logging.info(f"  ↪ Fetching {len(children)} more replies for post {post_id}...")
+        url = f"{self.base_url}/api/morechildren.json"
+        complete = True
+        for start in range(0, len(children), MORE_CHILDREN_BATCH):
+            params = {
+                'api_type': 'json',
+                'link_id': f"t3_{post_id}",  # Fullname of the post the replies belong to
+                'children': ','.join(children[start:start + MORE_CHILDREN_BATCH]),
+                'limit_children': 'false',
+                'raw_json': 1,
+                'sort': 'top'
+            }
+            try:
+                with self._more_children_lock:
+                    response = self._get(url, params=params)
+                things = orjson.loads(response.content)['json']['data']['things']
+            except (httpx.HTTPError, orjson.JSONDecodeError, KeyError) as e:
+                logging.warning(f"  ⚠️ Could not fetch more replies for post {post_id}: {e}")
+                complete = False
+                continue  # Still try the remaining batches
+            
+            # Things arrive flattened in tree order, so each parent is indexed before its replies;
+            # nested 'more' stubs among them are queued in `more` for the next round
+            for thing in things:
+                parent_id = thing['data'].get('parent_id', '')
+                parent = index.get(parent_id)
+                if parent is not None:
+                    self._extract_comments([thing], comments, comments.depth[parent] + 1, parent,
+                                           more=more, deep=deep, index=index)
+                elif parent_id.startswith('t3_'):  # Top-level comment on the post itself
+                    self._extract_comments([thing], comments, more=more, deep=deep, index=index)
+                # Otherwise the parent was skipped, so its replies are skipped too
+        return complete
+
+    def _fetch_continued_thread(self, post_id, parent_name, comments, index, more, deep):
+        """Fetch replies cut off at the depth limit by re-requesting the thread from their parent
+
+        Returns False if the thread could not be fetched.
+        """
+        parent = index.get(parent_name)
+        if parent is None:
+            return True  # The parent was skipped, so its replies are skipped too
+        logging.info(f"  ↪ Continuing thread below {parent_name} for post {post_id}...")
+        # Permalink of the parent comment, which returns it with its own reply tree
+        url = f"{self.base_url}/r/ausjdocs/comments/{post_id}/_/{parent_name.split('_', 1)[1]}.json"
+        try:
+            data = orjson.loads(self._get(url, params=COMMENT_PARAMS).content)
+            children = data[1]['data']['children']
+        except (httpx.HTTPError, orjson.JSONDecodeError, KeyError, IndexError) as e:
+            logging.warning(f"  ⚠️ Could not continue thread below {parent_name} for post {post_id}: {e}")
+            return False
         
-        for item in comment_data:
-            if item['kind'] == 't1':  # 't1' indicates a comment (not a post)
+        # The parent is already in the table, so only its replies are extracted
+        for item in children:
+            comment = item['data']
+            if item['kind'] == 't1' and comment.get('name') == parent_name:
+                replies = comment.get('replies')
+                if isinstance(replies, dict):
+                    self._extract_comments(replies['data']['children'], comments, comments.depth[parent] + 1,
+                                           parent, more=more, deep=deep, index=index)
+        return True
+
+    def _extract_comments(self, comment_data, table, depth=0, parent_idx=-1, more=None, deep=None, index=None):
+        """Extract comments and their nested replies into `table` using an explicit stack
+
+        Ids behind 'more' stubs are appended to `more`, the parents of 'continue this
+        thread' stubs (replies cut off at the depth limit) to `deep`, and each comment's
+        row is recorded in `index` under its fullname so fetched replies can be attached later.
+        """
+        # Each stack entry is (children to process, their depth, row of their parent comment)
+        stack = [(comment_data, depth, parent_idx)]
+        skip_authors = _SKIP_AUTHORS  # Local lookup in the hot loop
+        add = table.add
+        
+        while stack:
+            data, depth, parent_idx = stack.pop()
+            for item in data:
+                kind = item['kind']
+                if kind != 't1':  # 't1' indicates a comment (not a post)
+                    if kind == 'more':  # Replies Reddit did not inline
+                        stub = item['data']
+                        if stub.get('id') == '_':  # 'Continue this thread': cut off at the depth limit
+                            if deep is not None:
+                                deep.append(stub['parent_id'])
+                        elif more is not None:
+                            more.extend(stub.get('children', ()))
+                    continue
                 comment = item['data']
                 
                 # Skip deleted or automatically moderated comments
-                if comment.get('author') in ['[deleted]', 'AutoModerator']:
+                author = comment['author']  # Always present on 't1' comments
+                if author in skip_authors:
                     continue
                 
-                # Create a comment object with relevant fields
-                comment_obj = {
-                    'author': comment.get('author', ''),  # Get the author's name
-                    'body': comment.get('body', ''),  # Get the comment body
-                    'score': comment.get('score', 0),  # Get the score (upvotes)
-                    'created_utc': comment.get('created_utc', 0),  # Get the creation time in UTC
-                    'depth': depth,  # Keep track of the comment depth (to handle replies)
-                    'is_submitter': comment.get('is_submitter', False),  # Check if this is the OP's reply
-                    'replies': []  # Initialize an empty list for replies (nested comments)
-                }
-                
-                # If there are replies to the comment, recursively extract them
-                if 'replies' in comment and comment['replies']:
-                    if isinstance(comment['replies'], dict):  # Ensure replies are in a dict format
-                        replies_data = comment['replies']['data']['children']  # Extract replies
-                        comment_obj['replies'] = self._extract_comments(replies_data, depth + 1)  # Recursively get replies
+                # Add a row with the relevant fields ('t1' always carries these keys)
+                row = add(
+                    author,  # The author's name
+                    comment['body'],  # The comment body
+                    comment['score'],  # The score (upvotes)
+                    comment['created_utc'],  # The creation time in UTC
+                    depth,  # Keep track of the comment depth (to handle replies)
+                    comment.get('is_submitter', False),  # Check if this is the OP's reply
+                    parent_idx  # Row of the comment this replies to
+                )
+                if index is not None:
+                    index[comment.get('name')] = row
                 
-                # Append the comment object to the list of comments
-                comments.append(comment_obj)
-        
-        return comments  # Return the list of comments
+                # If there are replies to the comment, queue them with this row as their parent
+                replies = comment.get('replies')
+                if isinstance(replies, dict):  # Replies are '' when there are none
+                    stack.append((replies['data']['children'], depth + 1, row))
 
 def main():
     """Scrape comments from key hospital pharmacy posts"""
@@ -100,46 +316,47 @@ def main():
         '1oxmpn5': 'GPs and pharmacist calls'  # Another post ID and title
     }
     
-    scraper = CommentScraper()  # Create an instance of the CommentScraper class
-    all_data = {}  # Dictionary to store all the fetched data
+    summary = {}  # Post title and comment count per scraped post (bodies are not kept in memory)
+    total_comments = 0  # Running total of comments scraped
+    output_file = 'hospital_pharmacy_comments.jsonl'
     
-    print("="*70)
-    print("SCRAPING COMMENTS FROM KEY COLLABORATIVE POSTS")  # Header for the process
-    print("="*70)
-    print()
+    logging.info("="*70)
+    logging.info("SCRAPING COMMENTS FROM KEY COLLABORATIVE POSTS")  # Header for the process
+    logging.info("="*70)
     
-    # Loop through each post ID and description in the 'key_posts' dictionary
-    for post_id, description in key_posts.items():
-        print(f"\n{description}")  # Print the description of the post being processed
-        print("-" * 70)
-        
-        # Fetch comments for the current post
-        result = scraper.get_post_comments(post_id)
-        if result:
-            all_data[post_id] = result  # Store the result if successful
+    # Create a CommentScraper; the context manager closes its HTTP client when done
+    with CommentScraper() as scraper, open(output_file, 'wb') as f, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Fetch every post in parallel; threads overlap while waiting on the network
+        futures = {executor.submit(scraper.get_post_comments, post_id): post_id for post_id in key_posts}
         
-        time.sleep(3)  # Extra polite delay between each post request
-    
-    # Save the data to a JSON file
-    output_file = 'hospital_pharmacy_comments.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_data, f, indent=2, ensure_ascii=False)  # Write the data as a formatted JSON file
+        # Handle each post as soon as its fetch completes
+        for future in as_completed(futures):
+            post_id = futures[future]
+            logging.info(f"{key_posts[post_id]}")  # Log the description of the post that finished
+            logging.info("-" * 70)
+            
+            result = future.result()
+            if result:
+                # Write the post as one JSON line as soon as it is scraped
+                f.write(orjson.dumps(result))
+                f.write(b'\n')
+                summary[post_id] = (result['post_info']['title'], len(result['comments']))
+                total_comments += len(result['comments'])
     
-    print("\n" + "="*70)
-    print(f"✅ COMPLETE - Saved to {output_file}")  # Confirmation message
-    print("="*70)
+    logging.info("="*70)
+    logging.info(f"✅ COMPLETE - Saved to {output_file}")  # Confirmation message
+    logging.info("="*70)
     
     # Summary of the scraping process
-    total_comments = sum(len(data['comments']) for data in all_data.values())  # Total number of comments scraped
-    print(f"\n📊 SUMMARY:")
-    print(f"   Posts scraped: {len(all_data)}")  # Total number of posts scraped
-    print(f"   Total comments: {total_comments}")  # Total number of comments
+    logging.info("📊 SUMMARY:")
+    logging.info(f"   Posts scraped: {len(summary)}")  # Total number of posts scraped
+    logging.info(f"   Total comments: {total_comments}")  # Total number of comments
     
-    # Print a brief summary of each post and its comments
-    for post_id, data in all_data.items():
-        print(f"   {data['post_info']['title'][:50]}...")  # Display the post title (first 50 characters)
-        print(f"      Comments: {len(data['comments'])}")  # Number of comments for each post
-        print()
+    # Log a brief summary of each post and its comments
+    for title, num_comments in summary.values():
+        logging.info(f"   {title[:50]}...")  # Display the post title (first 50 characters)
+        logging.info(f"      Comments: {num_comments}")  # Number of comments for each post
 
 if __name__ == "__main__":
     main()  # Run the main function to start scraping
@@ -0,0 +1,79 @@
+"""
+Paces requests evenly across Reddit's reported X-Ratelimit-* budget
+"""
+
+import asyncio  # For waiting without blocking the event loop
+import random  # For jittering retry delays
+import threading  # For sharing one limiter between worker threads
+import time  # For monotonic clock and blocking waits
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Capped exponential backoff with jitter for the given (zero-based) retry attempt."""
+    return min(cap, base * (2 ** attempt)) * (0.5 + random.random())
+
+
+class RedditRateLimiter:
+    """Spread requests evenly over whatever budget Reddit reports as remaining.
+
+    Reddit returns ``X-Ratelimit-Remaining`` and ``X-Ratelimit-Reset``
+    (seconds until the window resets) on every response. Each request
+    claims the next slot, spaced so the remaining budget lasts until the
+    reset; until the first response arrives the budget is unknown and
+    requests go out immediately. The limiter may be shared between threads.
+    """
+
+    def __init__(self):
+        self.remaining = None  # Requests left in the current window (None until a response is seen)
+        self.reset_at = 0.0  # Monotonic time at which the window resets
+        self.next_at = 0.0  # Earliest monotonic time the next request may start
+        self._lock = threading.Lock()  # Guards the fields above
+
+    def update(self, headers):
+        """Refresh the budget from a response's X-Ratelimit-* headers."""
+        try:
+            remaining = float(headers['X-Ratelimit-Remaining'])
+            reset = float(headers['X-Ratelimit-Reset'])
+        except (KeyError, ValueError):
+            return  # Response carried no (usable) rate-limit information
+        with self._lock:
+            self.remaining = remaining
+            self.reset_at = time.monotonic() + reset
+
+    def reserve(self):
+        """Claim the next request slot and return how many seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            if self.remaining is None or now >= self.reset_at:
+                interval = 0.0  # Budget unknown or window already reset
+            else:
+                interval = (self.reset_at - now) / max(self.remaining, 1)
+                self.remaining -= 1  # Count the request before its response updates the budget
+            start = max(now, self.next_at)
+            self.next_at = start + interval
+            return start - now
+
+    def backoff(self, retry_after, delay):
+        """Push back every pending request after a 429; returns the delay applied.
+
+        The delay is at least ``delay`` and at least the server's ``Retry-After``.
+        """
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass  # No usable Retry-After header, keep the caller's backoff delay
+        with self._lock:
+            self.next_at = max(self.next_at, time.monotonic() + delay)
+        return delay
+
+    def acquire(self):
+        """Block until the next request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Wait, without blocking the event loop, until the next request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
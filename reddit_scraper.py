@@ -3,43 +3,165 @@
 Reddit scraper for r/ausjdocs - Extract pharmacy-related posts
 """
 
-import requests  # For sending HTTP requests
-import json  # For working with JSON data
-import time  # For adding time delays
+import ahocorasick  # For matching every search term in a single pass over post text
+import asyncio  # For running independent requests concurrently
+from collections import deque  # C-implemented stack for walking comment trees
+import httpx  # For sending HTTP requests (pooled, HTTP/2)
+import orjson  # For fast JSON parsing and serialisation
 from datetime import datetime  # To handle date and time
+import functools  # For caching formatted timestamps
 import csv  # For saving data in CSV format
+import operator  # For C-level field extraction when writing CSV rows
 import logging  # For logging messages (info, warnings, errors)
+from rate_limiter import RedditRateLimiter, backoff_delay  # Adapts request spacing to Reddit's rate-limit headers
 
 # Constants for repeated values
 BASE_URL = 'https://old.reddit.com'
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+HEADERS = {'User-Agent': USER_AGENT}  # Set once as the HTTP client's default headers
+
+# Ask Reddit to inline nested replies and return unescaped text in one response
+COMMENT_PARAMS = {'limit': 500, 'depth': 10, 'raw_json': 1, 'sort': 'top'}
+
+# Search terms related to pharmacy
+SEARCH_TERMS = [
+    'pharmacist',
+    'pharmacy',
+    'pharmacists',
+    'clinical pharmacist',
+    'ward pharmacist'
+]
+
+# All terms OR-ed into one query (phrases quoted) so a single search returns their union
+SEARCH_QUERY = '(' + ' OR '.join(f'"{t}"' if ' ' in t else t for t in SEARCH_TERMS) + ')'
+
+# Client errors that will not succeed on retry
+NON_RETRYABLE_STATUSES = frozenset((400, 403, 404))
+
+# Maximum number of requests allowed in flight at once
+MAX_CONCURRENT_REQUESTS = 4
 
 # Set up logging for better error tracking
 logging.basicConfig(level=logging.INFO)
 
-class RedditScraper:
-    def __init__(self):
-        # Initialize headers and base URL for requests
-        self.headers = {
-            'User-Agent': USER_AGENT
-        }
+
+@functools.lru_cache(maxsize=4096)
+def _fmt_ts(ts):
+    """Format a UTC timestamp as a local date string, caching repeated timestamps."""
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def build_term_matcher(terms):
+    """Compile search terms into an Aho-Corasick automaton matching lowercased text."""
+    automaton = ahocorasick.Automaton()
+    for term in terms:
+        key = term.lower()
+        automaton.add_word(key, (term, len(key)))  # Each match yields the original term and its length
+    automaton.make_automaton()
+    return automaton
+
+
+def match_terms(matcher, text):
+    """Return the terms occurring in lowercased text as whole words.
+
+    Aho-Corasick matches raw substrings, so a hit only counts when the characters on
+    both sides are not alphanumeric (e.g. 'pharmacist' is not counted inside
+    'pharmacists'). A hit lying inside a longer matched term is not counted either,
+    so 'clinical pharmacist' does not also count as 'pharmacist'.
+    """
+    spans = []  # (start, end, term) of each whole-word hit
+    for end_index, (term, length) in matcher.iter(text):
+        start = end_index - length + 1
+        after = end_index + 1
+        if start > 0 and text[start - 1].isalnum():
+            continue
+        if after < len(text) and text[after].isalnum():
+            continue
+        spans.append((start, after, term))
+    return {
+        term for start, end, term in spans
+        if not any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in spans)
+    }
+
+
+# Post fields read by extract_post_data, with the default used when a field is missing
+_POST_DEFAULTS = {
+    'title': '',
+    'author': '',
+    'score': 0,
+    'num_comments': 0,
+    'created_utc': 0,
+    'selftext': '',
+    'permalink': '',
+    'id': '',
+    'link_flair_text': '',
+}
+_POST_KEYS = tuple(_POST_DEFAULTS)
+_post_getter = operator.itemgetter(*_POST_KEYS)  # Reads all fields in one C-level call
+
+
+class AsyncRedditScraper:
+    def __init__(self, max_concurrency=MAX_CONCURRENT_REQUESTS):
+        # Caps how many requests run at once so concurrent searches stay within Reddit's budget
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # Shared by every request so concurrent tasks draw from one budget
+        self.limiter = RedditRateLimiter()
+        self.client = None  # Created in __aenter__
+
+    async def __aenter__(self):
+        # A single pooled HTTP/2 client keeps the connection to Reddit warm across calls
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers=HEADERS,  # Sent with every request without per-call merging
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the HTTP client and release its pooled connections."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
     
-    def fetch_with_retry(self, url, params, retries=3):
+    async def fetch_with_retry(self, url, params, retries=5):
         """Send a GET request with retries in case of network failures."""
         for attempt in range(retries):
+            last_attempt = attempt == retries - 1
             try:
-                response = requests.get(url, headers=self.headers, params=params)
+                await self.limiter.acquire_async()  # Wait for the next free slot in the rate budget
+                async with self.semaphore:
+                    response = await self.client.get(url, params=params)
+                self.limiter.update(response.headers)
+                if response.status_code == 429:  # Rate limited: honour Retry-After, then retry
+                    # Still pushes back other pending requests even when this one gives up
+                    delay = self.limiter.backoff(response.headers.get('Retry-After'), backoff_delay(attempt))
+                    if last_attempt:
+                        logging.error(f"Attempt {attempt + 1} rate limited, giving up")
+                    else:
+                        logging.warning(f"Attempt {attempt + 1} rate limited, backing off {delay:.1f}s")
+                    continue
+                if response.status_code in NON_RETRYABLE_STATUSES:
+                    logging.error(f"Request failed with status {response.status_code}, not retrying")
+                    break
                 response.raise_for_status()  # If status is not 200, raise an exception
-                return response.json()  # Parse and return JSON data
-            except requests.exceptions.RequestException as e:
-                logging.warning(f"Attempt {attempt + 1} failed: {e}")
-                time.sleep(2)  # Wait before retrying
-            except json.JSONDecodeError as e:
+                return orjson.loads(response.content)  # Parse and return JSON data
+            except httpx.HTTPError as e:
+                if last_attempt:
+                    logging.error(f"Attempt {attempt + 1} failed: {e}; giving up")
+                    break  # No point waiting when there is no retry left
+                delay = backoff_delay(attempt)  # Short waits for transient errors, growing each attempt
+                logging.warning(f"Attempt {attempt + 1} failed: {e}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)  # Wait before retrying
+            except orjson.JSONDecodeError as e:
                 logging.error(f"Error parsing JSON: {e}")
                 break  # Stop retrying if the response can't be parsed
         return None  # Return None if all retries fail
 
-    def search_subreddit(self, subreddit, query, limit=100):
+    async def search_subreddit(self, subreddit, query, limit=100):
         """Search a subreddit for posts containing the specified keywords."""
         posts = []  # List to hold the found posts
         after = None  # Used for pagination (getting the next set of results)
@@ -59,7 +181,7 @@ class RedditScraper:
                 params['after'] = after  # Add the next page token if available
             
             # Fetch the data with retries
-            data = self.fetch_with_retry(url, params)
+            data = await self.fetch_with_retry(url, params)
             if not data:
                 break  # Stop if we couldn't fetch the data
             
@@ -79,30 +201,47 @@ class RedditScraper:
             if not after:  # If no more pages, stop
                 logging.info("Reached end of results")
                 break
-            
-            time.sleep(2)  # Be polite and wait before sending another request
         
         return posts[:limit]  # Return the first 'limit' posts
 
+    def tag_posts(self, posts, matcher):
+        """Tag each post with the search terms found in its title or body.
+
+        Uses a matcher from build_term_matcher, so all terms are found in one pass over
+        each post's text; see match_terms for what counts as a hit. Matches are stored as
+        'matched_terms' (empty when the search matched on something other than a whole
+        term in the title or body, e.g. a stemmed form).
+        """
+        for post in posts:
+            text = f"{post['title']} {post['selftext']}".lower()
+            hits = match_terms(matcher, text)
+            post['matched_terms'] = ', '.join(sorted(hits))
+        return posts
+
     def extract_post_data(self, post_data):
         """Extract relevant data from a post's details."""
+        try:
+            values = _post_getter(post_data)
+        except KeyError:  # Fall back to per-field defaults when a field is missing
+            values = tuple(post_data.get(k, _POST_DEFAULTS[k]) for k in _POST_KEYS)
+        title, author, score, num_comments, created_utc, selftext, permalink, post_id, flair = values
         return {
-            'title': post_data.get('title', ''),
-            'author': post_data.get('author', ''),
-            'score': post_data.get('score', 0),
-            'num_comments': post_data.get('num_comments', 0),
-            'created_utc': post_data.get('created_utc', 0),
-            'created_date': datetime.fromtimestamp(post_data.get('created_utc', 0)).strftime('%Y-%m-%d %H:%M:%S'),
-            'selftext': post_data.get('selftext', ''),
-            'url': f"{BASE_URL}{post_data.get('permalink', '')}",
-            'id': post_data.get('id', ''),
-            'link_flair_text': post_data.get('link_flair_text', ''),
+            'title': title,
+            'author': author,
+            'score': score,
+            'num_comments': num_comments,
+            'created_utc': created_utc,
+            'created_date': _fmt_ts(int(created_utc)),
+            'selftext': selftext,
+            'url': BASE_URL + permalink,
+            'id': post_id,
+            'link_flair_text': flair,
         }
 
-    def get_post_comments(self, post_url):
+    async def get_post_comments(self, post_url):
         """Get comments from a specific post."""
         url = f"{post_url}.json"
-        data = self.fetch_with_retry(url, {})
+        data = await self.fetch_with_retry(url, COMMENT_PARAMS)
         if not data:
             return []  # Return empty if no data
         
@@ -110,39 +249,39 @@ class RedditScraper:
         if len(data) > 1:  # Check if there are comments
             comment_data = data[1]['data']['children']
             comments = self._extract_comments(comment_data)  # Extract comment details
-        
-        time.sleep(2)  # Politeness delay
         return comments
 
     def _extract_comments(self, comment_data):
         """Extract comments and their replies."""
         comments = []
-        stack = [(comment_data, 0)]  # Use a stack to handle comments and their replies
+        stack = deque()  # Use a stack to handle comments and their replies
+        stack.append((comment_data, 0))
         
         while stack:
             data, depth = stack.pop()
             for item in data:
                 if item['kind'] == 't1':  # Check if it's a comment (not a post)
-                    comment = item['data']
+                    c = item['data']
+                    # 't1' comments always carry these keys, so subscript them directly
                     comments.append({
-                        'author': comment.get('author', ''),
-                        'body': comment.get('body', ''),
-                        'score': comment.get('score', 0),
-                        'created_utc': comment.get('created_utc', 0),
+                        'author': c['author'],
+                        'body': c['body'],
+                        'score': c['score'],
+                        'created_utc': c['created_utc'],
                         'depth': depth  # Track the depth of replies
                     })
                     
-                    # Check for replies
-                    if 'replies' in comment and comment['replies']:
-                        if isinstance(comment['replies'], dict):
-                            stack.append((comment['replies']['data']['children'], depth + 1))
+                    # Check for replies ('' when there are none)
+                    replies = c.get('replies')
+                    if isinstance(replies, dict):
+                        stack.append((replies['data']['children'], depth + 1))
         
         return comments
 
     def save_to_json(self, data, filename):
         """Save the data to a JSON file."""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)  # Write data as JSON
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))  # Write data as UTF-8 JSON
         logging.info(f"Saved to {filename}")
 
     def save_to_csv(self, posts, filename):
@@ -151,62 +290,46 @@ class RedditScraper:
             logging.warning("No posts to save")
             return
         
-        keys = posts[0].keys()  # Use the keys from the first post as headers
+        keys = list(posts[0].keys())  # Use the keys from the first post as headers
+        getter = operator.itemgetter(*keys)  # Pulls every field of a post as one tuple
         with open(filename, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=keys)
-            writer.writeheader()  # Write header row
-            writer.writerows(posts)  # Write the posts
+            writer = csv.writer(f)
+            writer.writerow(keys)  # Write header row
+            writer.writerows(map(getter, posts))  # Write the posts
         logging.info(f"Saved to {filename}")
 
 
-def main():
-    scraper = RedditScraper()  # Create an instance of RedditScraper
-    
-    # Search terms related to pharmacy
-    search_terms = [
-        'pharmacist',
-        'pharmacy',
-        'pharmacists',
-        'clinical pharmacist',
-        'ward pharmacist'
-    ]
-    
-    all_posts = []  # List to store all unique posts
-    seen_ids = set()  # Set to keep track of already seen post IDs
-    
-    for term in search_terms:  # Loop through each search term
+async def main():
+    # Create an AsyncRedditScraper; the context manager closes its HTTP client
+    async with AsyncRedditScraper() as scraper:
         logging.info(f"\n{'='*60}")
-        logging.info(f"Searching for: {term}")
+        logging.info(f"Searching for: {SEARCH_QUERY}")
         logging.info(f"{'='*60}")
         
-        posts = scraper.search_subreddit('ausjdocs', term, limit=200)  # Search the subreddit
+        # One combined all-time search; Reddit returns each matching post once, so no dedup is needed
+        all_posts = await scraper.search_subreddit('ausjdocs', SEARCH_QUERY, limit=1000)
         
-        # Remove duplicates by checking post IDs
-        for post in posts:
-            if post['id'] not in seen_ids:
-                all_posts.append(post)
-                seen_ids.add(post['id'])
+        # Tag each post with the terms it mentions, matching all terms locally in one pass
+        scraper.tag_posts(all_posts, build_term_matcher(SEARCH_TERMS))
         
-        time.sleep(3)  # Extra delay between searches to be polite
-    
-    logging.info(f"\n{'='*60}")
-    logging.info(f"Total unique posts found: {len(all_posts)}")
-    logging.info(f"{'='*60}")
-    
-    # Save the results to JSON and CSV
-    output_dir = '.'
-    scraper.save_to_json(all_posts, f'{output_dir}/ausjdocs_pharmacy_posts.json')
-    scraper.save_to_csv(all_posts, f'{output_dir}/ausjdocs_pharmacy_posts.csv')
-    
-    # Optional: Fetch comments for top posts
-    logging.info("\nWould you like to fetch comments? (Uncomment below if yes)")
-    # for i, post in enumerate(all_posts[:10]):  # Get comments for top 10 posts
-    #     logging.info(f"Fetching comments for post {i+1}/10...")
-    #     comments = scraper.get_post_comments(post['url'])
-    #     post['comments'] = comments
+        logging.info(f"\n{'='*60}")
+        logging.info(f"Total unique posts found: {len(all_posts)}")
+        logging.info(f"{'='*60}")
+        
+        # Save the results to JSON and CSV
+        output_dir = '.'
+        scraper.save_to_json(all_posts, f'{output_dir}/ausjdocs_pharmacy_posts.json')
+        scraper.save_to_csv(all_posts, f'{output_dir}/ausjdocs_pharmacy_posts.csv')
+        
+        # Optional: Fetch comments for top posts
+        logging.info("\nWould you like to fetch comments? (Uncomment below if yes)")
+        # top_posts = all_posts[:10]  # Get comments for top 10 posts
+        # comments = await asyncio.gather(*[scraper.get_post_comments(post['url']) for post in top_posts])
+        # for post, post_comments in zip(top_posts, comments):
+        #     post['comments'] = post_comments
     
     logging.info("\nDone! Check the outputs folder for your data.")
 
 
 if __name__ == "__main__":
-    main()  # Run the main function
+    asyncio.run(main())  # Run the main coroutine